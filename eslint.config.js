@@ -11,7 +11,7 @@ export default [
   {
     languageOptions: {
       globals: globals.browser,
-      ecmaVersion: 2021,
+      ecmaVersion: 2022,
       sourceType: "module",
     },
     rules: {
@@ -1,22 +1,55 @@
 #!/usr/bin/env python3
 import argparse
-import json
 import os
+import re
 import subprocess
 import time
 import shutil
+import tempfile
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
+from pathlib import Path
+import numpy as np
 import pandas as pd
+import matplotlib
+matplotlib.use("Agg")  # the report is only saved to disk, never shown
 import matplotlib.pyplot as plt
 import seaborn as sns
+import orjson
+
+# Every marker the completion/metrics checks look for, matched in one scan per turn
+_TURN_MARKERS = re.compile(r"Generated code:|Code generation result: true|code : [24]")
+
+# Resolved once rather than searching PATH on every spawn
+_NODE = shutil.which("node") or "node"
+
+# Merged over settings.js via SETTINGS_PATH. Deliberate differences: no mindserver per run,
+# no init_message competing with the task goal, and the neutral _default.json base profile.
+_SETTINGS_TEMPLATE = """
+export default {{
+    profiles: {profiles},
+    allow_insecure_coding: true,
+    host_mindserver: false,
+    init_message: null,
+    num_examples: 3,
+    relevant_docs_count: 5,
+    code_timeout_mins: 5,
+    base_profile: "./profiles/defaults/_default.json"
+}}
+"""
+
+_agent_locks = {}
+_agent_locks_guard = threading.Lock()
 
 def load_config(config_path):
     """Load the benchmark configuration."""
     with open(config_path, 'r') as f:
-        return json.load(f)
+        return orjson.loads(f.read())
 
 def setup_profile(model_profile):
-    """Copy the model profile to the active profile location."""
+    """Resolve the agent name and profile path for a model."""
     profile_path = model_profile["profile"]
     # Ensure the profile exists
     if not os.path.exists(profile_path):
@@ -24,59 +57,46 @@ def setup_profile(model_profile):
     
     # Get the profile name from the file
     with open(profile_path, 'r') as f:
-        profile_data = json.load(f)
+        profile_data = orjson.loads(f.read())
         agent_name = profile_data["name"]
     
-    # Create a temporary profile for this benchmark run
-    benchmark_profile_path = f"./{agent_name}.json"
-    shutil.copy(profile_path, benchmark_profile_path)
-    
-    return agent_name, benchmark_profile_path
+    return agent_name, profile_path
 
 def edit_settings(profiles):
-    """Edit settings.js to use the specified profiles."""
-    # Create a temporary settings file with the profiles
-    settings_content = f"""
-    export default {{
-        profiles: {json.dumps(profiles)},
-        allow_insecure_coding: true,
-        port: 55916,
-        num_examples: 3,
-        relevant_docs_count: 5,
-        code_timeout_mins: 5,
-        base_profile: "./profiles/defaults/_default.json"
-    }}
-    """
-    
-    with open("settings.js.tmp", 'w') as f:
-        f.write(settings_content)
-    
-    # Backup original settings
-    if os.path.exists("settings.js"):
-        shutil.copy("settings.js", "settings.js.bak")
-    
-    # Replace settings
-    shutil.move("settings.js.tmp", "settings.js")
+    """Write a private settings module for one run and return its path."""
+    # .mjs so node loads it as an ES module outside of this package
+    settings_path = Path(tempfile.gettempdir()) / f"settings_{uuid.uuid4().hex}.mjs"
+    settings_path.write_text(_SETTINGS_TEMPLATE.format(profiles=orjson.dumps(profiles).decode()))
+    
+    return settings_path
 
-def restore_settings():
-    """Restore original settings.js."""
-    if os.path.exists("settings.js.bak"):
-        shutil.move("settings.js.bak", "settings.js")
+def _agent_lock(agent_name):
+    """Return the lock serializing runs that share an agent name."""
+    with _agent_locks_guard:
+        return _agent_locks.setdefault(agent_name, threading.Lock())
 
-def run_benchmark(model, task, config, run_number):
+def run_benchmark(model, task, config, run_number, session_ts):
     """Run a single benchmark for a model on a task."""
-    print(f"Running benchmark: {model['name']} on {task['id']} (Run {run_number})")
-    
     # Setup the model profile
     agent_name, profile_path = setup_profile(model)
     
-    # Edit settings to use this profile
-    edit_settings([profile_path])
-    
+    # The agent writes to bots/{agent_name}/, so runs of the same profile can't overlap
+    with _agent_lock(agent_name):
+        print(f"Running benchmark: {model['name']} on {task['id']} (Run {run_number})")
+        
+        # Point this run at its own settings
+        settings_path = edit_settings([profile_path])
+        try:
+            return _run_task(model, task, run_number, session_ts, agent_name, settings_path)
+        finally:
+            os.remove(settings_path)
+
+def _run_task(model, task, run_number, session_ts, agent_name, settings_path):
+    """Run main.js for one task and collect its results."""
     # Prepare results directory
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    results_dir = f"benchmark_results/{timestamp}/{model['name']}/{task['id']}/run_{run_number}"
-    os.makedirs(results_dir, exist_ok=True)
+    results_dir = Path("benchmark_results") / session_ts / model['name'] / task['id'] / f"run_{run_number}"
+    results_dir.mkdir(parents=True, exist_ok=True)
+    bot_dir = Path("bots") / agent_name
     
     # Run the task
     start_time = time.time()
@@ -86,155 +106,154 @@ def run_benchmark(model, task, config, run_number):
     
     # Run the task using main.js with appropriate arguments
     cmd = [
-        "node", 
+        _NODE, 
         "main.js", 
         "--task_path", "benchmark_tasks.json", 
         "--task_id", task['id']
     ]
     
     try:
-        process = subprocess.run(
-            cmd, 
-            check=True,
-            capture_output=True,
-            text=True,
-            timeout=task.get('time_limit', 900) + 60  # Add 60 seconds buffer
-        )
-        
-        # Save stdout and stderr
-        with open(f"{results_dir}/stdout.log", 'w') as f:
-            f.write(process.stdout)
-        
-        with open(f"{results_dir}/stderr.log", 'w') as f:
-            f.write(process.stderr)
+        # Stream stdout and stderr straight into the run's log files
+        with open(results_dir / "stdout.log", 'wb') as stdout_f, open(results_dir / "stderr.log", 'wb') as stderr_f:
+            subprocess.run(
+                cmd, 
+                check=True,
+                env={**os.environ, "SETTINGS_PATH": str(settings_path)},
+                stdout=stdout_f,
+                stderr=stderr_f,
+                timeout=task.get('time_limit', 900) + 60  # Add 60 seconds buffer
+            )
             
     except subprocess.TimeoutExpired:
         print(f"Task timed out: {model['name']} on {task['id']}")
-        with open(f"{results_dir}/timeout.log", 'w') as f:
-            f.write("Task timed out")
+        (results_dir / "timeout.log").write_text("Task timed out")
     except Exception as e:
         print(f"Error running task: {e}")
-        with open(f"{results_dir}/error.log", 'w') as f:
-            f.write(f"Error: {str(e)}")
+        (results_dir / "error.log").write_text(f"Error: {str(e)}")
     
     end_time = time.time()
     time_taken = end_time - start_time
     
-    # Copy memory.json and other relevant files
-    memory_path = f"bots/{agent_name}/memory.json"
-    if os.path.exists(memory_path):
-        shutil.copy(memory_path, f"{results_dir}/memory.json")
+    # Copy memory.json and other relevant files, skipping any the agent never wrote
+    try:
+        shutil.copy(bot_dir / "memory.json", results_dir / "memory.json")
+    except FileNotFoundError:
+        pass
     
     # Copy action code files
-    action_code_dir = f"bots/{agent_name}/action-code/"
-    if os.path.exists(action_code_dir):
-        os.makedirs(f"{results_dir}/action-code", exist_ok=True)
-        for file in os.listdir(action_code_dir):
-            shutil.copy(f"{action_code_dir}/{file}", f"{results_dir}/action-code/{file}")
-    
-    # Check task completion
-    success = check_task_completion(agent_name, task['id'])
+    try:
+        shutil.copytree(bot_dir / "action-code", results_dir / "action-code", dirs_exist_ok=True, copy_function=shutil.copy)
+    except FileNotFoundError:
+        pass
     
-    # Calculate metrics
-    metrics = calculate_metrics(agent_name, time_taken, success)
+    # Check task completion and calculate metrics
+    metrics = analyze_memory(agent_name, time_taken)
     
     # Save metrics
-    with open(f"{results_dir}/metrics.json", 'w') as f:
-        json.dump(metrics, f, indent=2)
+    (results_dir / "metrics.json").write_bytes(orjson.dumps(metrics, option=orjson.OPT_INDENT_2))
     
     return metrics
 
-def check_task_completion(agent_name, task_id):
-    """Check if the task was completed successfully."""
-    memory_path = f"bots/{agent_name}/memory.json"
+def _load_turns(agent_name):
+    """Load the turns from an agent's memory.json, or [] if it can't be read."""
+    # History keeps at most max_messages turns in memory.json, so the file stays
+    # small and one orjson parse is cheaper than streaming it with a pure-Python parser
+    memory_path = Path("bots") / agent_name / "memory.json"
     try:
-        with open(memory_path, 'r') as f:
-            memory = json.load(f)
-            
-        # Check the last system message in turns
-        for turn in reversed(memory['turns']):
-            if turn['role'] == 'system' and 'code' in turn['content']:
-                # Extract completion code
-                if 'code : 2' in turn['content']:
-                    return True  # Task successful
-                elif 'code : 4' in turn['content']:
-                    return False  # Task failed
-    except (FileNotFoundError, json.JSONDecodeError) as e:
+        # orjson parses the raw bytes directly, skipping the decode to str
+        with open(memory_path, 'rb') as f:
+            return orjson.loads(f.read())['turns']
+    except (FileNotFoundError, orjson.JSONDecodeError) as e:
         print(f"Error reading memory for agent {agent_name}: {e}")
     
-    return False  # Default to failure if no conclusive result found
+    return []
 
-def calculate_metrics(agent_name, time_taken, success):
-    """Calculate metrics for the benchmark run."""
-    memory_path = f"bots/{agent_name}/memory.json"
-    metrics = {
-        "task_completion": success,
-        "time_taken": time_taken,
-        "code_generation_attempts": 0,
-        "code_execution_success_rate": 0,
-        "tokens_consumed": 0
-    }
-    
-    try:
-        with open(memory_path, 'r') as f:
-            memory = json.load(f)
+def analyze_memory(agent_name, time_taken):
+    """Check task completion and calculate metrics in one pass over the agent's turns."""
+    turns = _load_turns(agent_name)
+    
+    code_attempts = 0
+    code_successes = 0
+    total_chars = 0
+    last_result = None  # Completion code of the latest system turn that reported one
+    
+    for turn in turns:
+        content = turn['content']
+        total_chars += len(content)
+        if turn['role'] != 'system':
+            continue
+        markers = set(_TURN_MARKERS.findall(content))
         
         # Count code generation attempts
-        code_attempts = 0
-        code_successes = 0
-        
-        for turn in memory['turns']:
-            if turn['role'] == 'system' and 'Generated code:' in turn['content']:
-                code_attempts += 1
-            if turn['role'] == 'system' and 'Code generation result: true' in turn['content']:
-                code_successes += 1
-        
-        metrics["code_generation_attempts"] = code_attempts
-        
-        if code_attempts > 0:
-            metrics["code_execution_success_rate"] = code_successes / code_attempts
-        
-        # Estimate tokens consumed (this is approximate)
-        total_chars = sum(len(turn['content']) for turn in memory['turns'])
-        metrics["tokens_consumed"] = total_chars / 4  # Rough estimate: 4 chars per token
+        if 'Generated code:' in markers:
+            code_attempts += 1
+        if 'Code generation result: true' in markers:
+            code_successes += 1
         
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        print(f"Error calculating metrics for agent {agent_name}: {e}")
-    
-    return metrics
+        # Overwritten as we go, so the last system message with a completion code wins
+        if 'code : 2' in markers:
+            last_result = True  # Task successful
+        elif 'code : 4' in markers:
+            last_result = False  # Task failed
+    
+    return {
+        "task_completion": bool(last_result),  # Default to failure if no conclusive result found
+        "time_taken": time_taken,
+        "code_generation_attempts": code_attempts,
+        "code_execution_success_rate": code_successes / code_attempts if code_attempts else 0,
+        "tokens_consumed": total_chars / 4  # Rough estimate: 4 chars per token
+    }
 
 def generate_report(results, config, output_dir):
     """Generate a comprehensive benchmark report."""
-    # Create DataFrame from results
-    data = []
+    # Create DataFrame from results, filling preallocated typed columns
+    n = sum(len(task_runs) for model_results in results.values() for task_runs in model_results.values())
+    columns = {
+        "Model": [None] * n,
+        "Task": [None] * n,
+        "Run": np.empty(n, dtype="i4"),
+        "Completed": np.empty(n, dtype="?"),
+        "Time (s)": np.empty(n, dtype="f8"),
+        "Code Attempts": np.empty(n, dtype="i8"),
+        "Code Success Rate": np.empty(n, dtype="f8"),
+        "Tokens": np.empty(n, dtype="f8")
+    }
     
+    i = 0
     for model_name, model_results in results.items():
         for task_id, task_runs in model_results.items():
             for run_num, metrics in task_runs.items():
-                data.append({
-                    "Model": model_name,
-                    "Task": task_id,
-                    "Run": run_num,
-                    "Completed": metrics["task_completion"],
-                    "Time (s)": metrics["time_taken"],
-                    "Code Attempts": metrics["code_generation_attempts"],
-                    "Code Success Rate": metrics["code_execution_success_rate"],
-                    "Tokens": metrics["tokens_consumed"]
-                })
-    
-    df = pd.DataFrame(data)
+                columns["Model"][i] = model_name
+                columns["Task"][i] = task_id
+                columns["Run"][i] = run_num
+                columns["Completed"][i] = metrics["task_completion"]
+                columns["Time (s)"][i] = metrics["time_taken"]
+                columns["Code Attempts"][i] = metrics["code_generation_attempts"]
+                columns["Code Success Rate"][i] = metrics["code_execution_success_rate"]
+                columns["Tokens"][i] = metrics["tokens_consumed"]
+                i += 1
+    
+    df = pd.DataFrame(columns)
+    
+    # Low-cardinality labels, ordered as in the config; groupby then works on integer codes
+    df["Model"] = pd.Categorical(df["Model"], categories=[model["name"] for model in config["models"]])
+    df["Task"] = pd.Categorical(df["Task"], categories=[task["id"] for task in config["tasks"]])
     
     # Save raw data
     df.to_csv(f"{output_dir}/benchmark_data.csv", index=False)
     
-    # Generate summary statistics
-    summary = df.groupby(["Model", "Task"]).agg({
+    # Generate summary statistics; the plots below are drawn from these pre-aggregated frames
+    per_task = df.groupby(["Model", "Task"], sort=False, observed=True).agg({
         "Completed": "mean",
         "Time (s)": "mean",
         "Code Attempts": "mean",
         "Code Success Rate": "mean",
         "Tokens": "mean"
-    }).reset_index()
+    })
+    summary = per_task.reset_index()
+    
+    # Per-model means over runs, since failed runs can leave tasks with different run counts
+    per_model = df.groupby("Model", sort=False, observed=True)[["Code Success Rate", "Tokens"]].mean().reset_index()
     
     summary.to_csv(f"{output_dir}/benchmark_summary.csv", index=False)
     
@@ -243,21 +262,94 @@ def generate_report(results, config, output_dir):
     
     # Completion rate by model and task
     plt.subplot(2, 2, 1)
-    completion_pivot = df.pivot_table(
-        values="Completed", 
-        index="Task", 
-        columns="Model", 
-        aggfunc="mean"
-    )
+    completion_pivot = per_task["Completed"].unstack("Model")
     sns.heatmap(completion_pivot, annot=True, cmap="YlGnBu", vmin=0, vmax=1)
     plt.title("Task Completion Rate")
     
     # Time taken by model and task
     plt.subplot(2, 2, 2)
-    sns.barplot(x="Model", y="Time (s)", hue="Task", data=df)
+    sns.barplot(x="Model", y="Time (s)", hue="Task", data=summary, errorbar=None)
     plt.title("Average Time to Completion")
     plt.xticks(rotation=45)
     
     # Code success rate by model
     plt.subplot(2, 2, 3)
-    sns.barplot(x="Model", y="Code Success Rate",
\ No newline at end of file
+    sns.barplot(x="Model", y="Code Success Rate", data=per_model, errorbar=None)
+    plt.title("Code Execution Success Rate")
+    plt.xticks(rotation=45)
+    
+    # Tokens consumed by model
+    plt.subplot(2, 2, 4)
+    sns.barplot(x="Model", y="Tokens", data=per_model, errorbar=None)
+    plt.title("Estimated Tokens Consumed")
+    plt.xticks(rotation=45)
+    
+    plt.tight_layout()
+    plt.savefig(f"{output_dir}/benchmark_results.png")
+    plt.close()
+    
+    return summary
+
+def run_model_benchmarks(model, config, session_ts):
+    """Run every task for one model in sequence and return its results."""
+    runs_per_task = config.get("runs_per_task", 1)
+    model_results = {task["id"]: {} for task in config["tasks"]}
+    
+    for task in config["tasks"]:
+        for run_number in range(1, runs_per_task + 1):
+            # One broken run shouldn't discard the rest of the session; leave it out of the report
+            try:
+                model_results[task["id"]][run_number] = run_benchmark(model, task, config, run_number, session_ts)
+            except Exception as e:
+                print(f"Benchmark failed: {model['name']} on {task['id']} (Run {run_number}): {e}")
+    
+    return model_results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark LLMs on Minecraft tasks')
+    parser.add_argument('--config', default="benchmark_config.json", help='Path to the benchmark configuration')
+    parser.add_argument('--output_dir', default=None,
+                        help='Directory to write the report to (defaults to this session\'s results directory)')
+    parser.add_argument('--num_parallel', default=1, type=int,
+                        help='Number of models to benchmark concurrently. All runs share one Minecraft world '
+                             'and each task start clears dropped items, so values above 1 need a separate '
+                             'world/server per worker to keep results comparable')
+    
+    args = parser.parse_args()
+    
+    config = load_config(args.config)
+    
+    # One timestamp per session, so all of its runs land under the same directory
+    session_ts = datetime.now().strftime("%Y%m%d_%H%M%S")
+    output_dir = args.output_dir or f"benchmark_results/{session_ts}"
+    
+    # A model's runs all use the same agent (and bots/ directory), so each model runs its
+    # runs in sequence on one worker while different models overlap. Runs mostly wait
+    # on a node subprocess, so threads suffice.
+    results = {model["name"]: {} for model in config["models"]}
+    
+    with ThreadPoolExecutor(max_workers=args.num_parallel) as executor:
+        futures = {
+            executor.submit(run_model_benchmarks, model, config, session_ts): model
+            for model in config["models"]
+        }
+        try:
+            for future in as_completed(futures):
+                results[futures[future]["name"]] = future.result()
+        except BaseException:
+            # e.g. Ctrl-C: drop the queued models instead of waiting on all of them
+            executor.shutdown(cancel_futures=True)
+            raise
+    
+    if not any(task_runs for model_results in results.values() for task_runs in model_results.values()):
+        print("No benchmark runs completed; skipping report.")
+        return
+    
+    os.makedirs(output_dir, exist_ok=True)
+    summary = generate_report(results, config, output_dir)
+    
+    print("Benchmark complete. Summary:")
+    print(summary.to_string(index=False))
+
+if __name__ == "__main__":
+    main()
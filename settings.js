@@ -1,3 +1,8 @@
+import { pathToFileURL } from 'url';
+
+// optional per-run overrides, e.g. the temporary settings module written by llm_benchmark.py
+const overrides = process.env.SETTINGS_PATH ? (await import(pathToFileURL(process.env.SETTINGS_PATH).href)).default : {};
+
 export default 
 {
     "minecraft_version": "1.20.4", // supports up to 1.21.1
@@ -44,4 +49,6 @@ export default
     "verbose_commands": true, // show full command syntax
     "narrate_behavior": true, // chat simple automatic actions ('Picking up item!')
     "chat_bot_messages": true, // publicly chat messages to other bots
+
+    ...overrides,
 }